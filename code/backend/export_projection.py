@@ -0,0 +1,37 @@
+# backend/export_projection.py
+"""
+One-off export of the fitted scaler + PCA as a fused, memory-mappable projection.
+
+Reads models/scaler.pkl and models/pca_transform.pkl and writes
+models/projection_weight.npy and models/projection_bias.npy, plus the SHA-256 of both
+pickles in models/projection_sources.json. When the recorded digests match the current
+pickles, load_model() in main.py memory-maps the arrays instead of unpickling sklearn
+objects. Re-run this whenever the scaler or PCA is retrained; until then load_model()
+falls back to the pickles.
+"""
+import os
+from pathlib import Path
+
+import joblib
+
+from projection import fuse_scaler_pca
+
+MODELS_DIR = Path(os.path.dirname(os.path.abspath(__file__))).parent.parent / "models"
+
+
+def export_projection():
+    scaler_path = MODELS_DIR / "scaler.pkl"
+    pca_path = MODELS_DIR / "pca_transform.pkl"
+    scaler = joblib.load(scaler_path)
+    pca = joblib.load(pca_path)
+
+    projection = fuse_scaler_pca(scaler, pca)
+    if projection is None:
+        raise SystemExit("Could not fuse scaler + PCA; keep serving from the .pkl files")
+
+    projection.save(MODELS_DIR, [scaler_path, pca_path])
+    print(f"Saved {projection.weight.shape[0]}x{projection.weight.shape[1]} projection to {MODELS_DIR}")
+
+
+if __name__ == "__main__":
+    export_projection()
@@ -9,38 +9,62 @@ import xgboost as xgb
 import ember
 import numpy as np
 import os
+import asyncio
+import hashlib
+import struct
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 from pathlib import Path
 from sklearn.feature_extraction import FeatureHasher
+from projection import AffineProjection, fuse_scaler_pca
 
 # --- MONKEY PATCH START: Fix ember compatibility with recent scikit-learn ---
 # The default ember library uses FeatureHasher with single strings, which recent scikit-learn rejects.
 # We patch the class method to wrap inputs in a list, ensuring compatibility.
+# FeatureHasher is stateless, so the hashers are built once and shared across calls.
+_HASHER_PAIR_50 = FeatureHasher(50, input_type="pair")
+_HASHER_STRING_50 = FeatureHasher(50, input_type="string")
+
+def _hash_into(out, hasher, raw):
+    """Scatter one sample's hashed features into `out` (a zeroed slice of the result buffer)."""
+    # FeatureHasher sums duplicate indices, so the sparse row maps 1:1 onto dense positions
+    row = hasher.transform([raw])
+    out[row.indices] = row.data
+
 def fixed_section_info_process_raw_features(self, raw_obj):
     sections = raw_obj['sections']
-    general = [
-        len(sections),
-        sum(1 for s in sections if s['size'] == 0),
-        sum(1 for s in sections if s['name'] == ""),
-        sum(1 for s in sections if 'MEM_READ' in s['props'] and 'MEM_EXECUTE' in s['props']),
-        sum(1 for s in sections if 'MEM_WRITE' in s['props'])
-    ]
+    # Single float32 buffer: 5 general counts followed by five 50-wide hashed blocks
+    out = np.zeros(255, dtype=np.float32)
+    # General counts, gathered in a single pass over the section table
+    n_zero_size = n_empty_name = n_read_execute = n_write = 0
+    for s in sections:
+        props = s['props']
+        if s['size'] == 0:
+            n_zero_size += 1
+        if s['name'] == "":
+            n_empty_name += 1
+        if 'MEM_READ' in props and 'MEM_EXECUTE' in props:
+            n_read_execute += 1
+        if 'MEM_WRITE' in props:
+            n_write += 1
+    out[0:5] = [len(sections), n_zero_size, n_empty_name, n_read_execute, n_write]
     section_sizes = [(s['name'], s['size']) for s in sections]
-    section_sizes_hashed = FeatureHasher(50, input_type="pair").transform([section_sizes]).toarray()[0]
+    _hash_into(out[5:55], _HASHER_PAIR_50, section_sizes)
     section_entropy = [(s['name'], s['entropy']) for s in sections]
-    section_entropy_hashed = FeatureHasher(50, input_type="pair").transform([section_entropy]).toarray()[0]
+    _hash_into(out[55:105], _HASHER_PAIR_50, section_entropy)
     section_vsize = [(s['name'], s['vsize']) for s in sections]
-    section_vsize_hashed = FeatureHasher(50, input_type="pair").transform([section_vsize]).toarray()[0]
+    _hash_into(out[105:155], _HASHER_PAIR_50, section_vsize)
 
     # PATCH: wrap raw_obj['entry'] in a list -> [[raw_obj['entry']]]
-    entry_name_hashed = FeatureHasher(50, input_type="string").transform([[raw_obj['entry']]]).toarray()[0]
+    _hash_into(out[155:205], _HASHER_STRING_50, [raw_obj['entry']])
 
     characteristics = [p for s in sections for p in s['props'] if s['name'] == raw_obj['entry']]
-    characteristics_hashed = FeatureHasher(50, input_type="string").transform([characteristics]).toarray()[0]
+    _hash_into(out[205:255], _HASHER_STRING_50, characteristics)
 
-    return np.hstack([
-        general, section_sizes_hashed, section_entropy_hashed, section_vsize_hashed, entry_name_hashed,
-        characteristics_hashed
-    ]).astype(np.float32)
+    return out
 
 # Apply the patch immediately after import
 try:
@@ -53,7 +77,19 @@ except Exception as e:
     print(f"Error applying monkey patch: {e}")
 # --- MONKEY PATCH END ---
 
-app = FastAPI()
+# Build the extractor once; its feature objects hold no per-file state, so worker threads can share it
+EXTRACTOR = ember.PEFeatureExtractor(2)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Load the model inside each worker process at startup rather than at import time,
+    # so forked/spawned workers don't inherit (or duplicate) the parent's copy
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, init_model)
+    await loop.run_in_executor(EXECUTOR, warm_up)
+    yield
+
+app = FastAPI(lifespan=lifespan)
 
 # CORS so your React app (localhost:3000 or 5173 etc.) can call this API
 origins = [
@@ -75,6 +111,9 @@ app.add_middleware(
 def read_root():
     return {"message": "Malware Detection API is running. Send POST requests to /predict."}
 
+# Endpoints declare this as response_model, which lets FastAPI >= 0.130 serialize replies
+# straight to JSON bytes in Pydantic's Rust core. Keep the default response class:
+# a custom one such as ORJSONResponse would bypass that path.
 class PredictionResponse(BaseModel):
     label: str
     confidence: float
@@ -85,7 +124,12 @@ import joblib
 def load_model():
     """
     Load your trained malware detection model, scaler, and PCA.
-    This runs once when the server starts.
+    This runs once in each worker when the server starts.
+
+    Return:
+      (model, scaler, pca, projection). If the fused projection exported by
+      export_projection.py is present and was exported from the current pickles,
+      it is memory-mapped and scaler/pca are None.
     """
     current_dir = Path(os.path.dirname(__file__))
     project_root = current_dir.parent.parent  # Go up to ENEE457_Group7 root
@@ -94,23 +138,123 @@ def load_model():
     model_path = results_dir / "xgboost_pca_model.pkl"
     scaler_path = results_dir / "scaler.pkl"
     pca_path = results_dir / "pca_transform.pkl"
+    has_projection = AffineProjection.exists(results_dir)
+    if has_projection and AffineProjection.is_stale(results_dir, [scaler_path, pca_path]):
+        print("Warning: scaler/PCA pickles don't match the exported projection; "
+              "loading the pickles instead (re-run export_projection.py)")
+        has_projection = False
 
-    if not (model_path.exists() and scaler_path.exists() and pca_path.exists()):
+    if not (model_path.exists() and (has_projection or (scaler_path.exists() and pca_path.exists()))):
         print(f"Warning: Model files not found in {results_dir}")
-        return None, None, None
+        return None, None, None, None
 
     try:
         model = joblib.load(model_path)
-        scaler = joblib.load(scaler_path)
-        pca = joblib.load(pca_path)
+        if has_projection:
+            scaler = pca = None
+            projection = AffineProjection.load(results_dir)
+        else:
+            scaler = joblib.load(scaler_path)
+            pca = joblib.load(pca_path)
+            projection = fuse_scaler_pca(scaler, pca)
+
+        if isinstance(model, xgb.XGBModel):
+            # Keep XGBoost to this worker's share of the cores instead of all of them
+            model.set_params(n_jobs=THREADS_PER_WORKER)
+
+        # Optional GPU inference, e.g. MODEL_DEVICE=cuda (XGBoost >= 2.0)
+        device = os.environ.get("MODEL_DEVICE")
+        if device and isinstance(model, xgb.XGBModel):
+            model.set_params(device=device)
+            print(f"XGBoost inference device set to {device}")
             
         print(f"Model pipeline loaded from {results_dir}")
-        return model, scaler, pca
+        return model, scaler, pca, projection
     except Exception as e:
         print(f"Error loading model pipeline: {e}")
-        return None, None, None
+        return None, None, None, None
+
+# Populated by init_model() from the app's lifespan handler
+model = scaler = pca = projection = None
+
+def init_model():
+    """Load the model pipeline into the module globals used by predict_file."""
+    global model, scaler, pca, projection
+    model, scaler, pca, projection = load_model()
+
+# Threshold tuned for better recall (default 0.5 was too conservative)
+THRESHOLD = 0.35
+
+# Server worker processes: one per two cores unless WEB_CONCURRENCY says otherwise
+WORKERS = int(os.environ.get("WEB_CONCURRENCY", max(1, (os.cpu_count() or 2) // 2)))
+# Each worker process gets its share of the cores for its threads and for XGBoost
+THREADS_PER_WORKER = max(1, (os.cpu_count() or 1) // WORKERS)
+
+# Worker threads for CPU-bound feature extraction and inference, kept off the event loop.
+# numpy and XGBoost release the GIL in native code, so requests overlap instead of queueing.
+EXECUTOR = ThreadPoolExecutor(max_workers=THREADS_PER_WORKER)
+
+# LRU cache of recent predictions keyed by the SHA-256 digest of the file contents,
+# so re-submitted samples skip extraction and inference entirely
+PREDICTION_CACHE_SIZE = 10_000
+_prediction_cache = OrderedDict()
+_prediction_cache_lock = threading.Lock()
+
+def file_digest(file_bytes: bytes) -> bytes:
+    return hashlib.sha256(file_bytes).digest()
+
+def cache_get(key: bytes):
+    """Return the cached (label, confidence) for `key`, or None."""
+    with _prediction_cache_lock:
+        result = _prediction_cache.get(key)
+        if result is not None:
+            _prediction_cache.move_to_end(key)
+        return result
+
+def cache_put(key: bytes, result):
+    """Remember a successful prediction, evicting the least recently used entry when full."""
+    if result[0] not in ("malicious", "benign"):
+        return
+    with _prediction_cache_lock:
+        _prediction_cache[key] = result
+        _prediction_cache.move_to_end(key)
+        if len(_prediction_cache) > PREDICTION_CACHE_SIZE:
+            _prediction_cache.popitem(last=False)
+
+def is_pe(file_bytes: bytes) -> bool:
+    """Cheap MZ + PE signature check so non-PE uploads never reach the LIEF parser."""
+    if len(file_bytes) < 0x40 or file_bytes[:2] != b"MZ":
+        return False
+    pe_offset = int.from_bytes(file_bytes[0x3C:0x40], "little")
+    return file_bytes[pe_offset:pe_offset + 4] == b"PE\x00\x00"
+
+def extract_features(file_bytes: bytes) -> np.ndarray:
+    """Extract EMBER v2 features (2,381 dimensions)."""
+    return np.array(EXTRACTOR.feature_vector(file_bytes), dtype=np.float32)
 
-model, scaler, pca = load_model()
+def predict_features(features: np.ndarray) -> np.ndarray:
+    """
+    Run the scaler -> PCA -> model pipeline on an (N, 2381) feature matrix.
+
+    Return:
+      malicious probability for each row, shape (N,)
+    """
+    if projection is not None:
+        # Scaling + PCA as one precomputed affine map
+        features_pca = projection.transform(features)
+    else:
+        # Apply Scaling
+        features_scaled = scaler.transform(features)
+
+        # Apply PCA
+        features_pca = pca.transform(features_scaled)
+
+    # Predict
+    # model.predict returns class labels, predict_proba returns probabilities
+    if hasattr(model, "predict_proba"):
+        return model.predict_proba(features_pca)[:, 1]  # Probability of class 1 (Malicious)
+    # Fallback if predict_proba is not available
+    return np.asarray(model.predict(features_pca), dtype=np.float64)
 
 def predict_file(file_bytes: bytes):
     """
@@ -122,59 +266,212 @@ def predict_file(file_bytes: bytes):
     if model is None:
         return "Model not loaded", 0.0
 
+    # Anything without a PE header can't be a Windows executable
+    if not is_pe(file_bytes):
+        return "benign", 0.0
+
+    key = file_digest(file_bytes)
+    cached = cache_get(key)
+    if cached is not None:
+        return cached
+
     try:
         # Extract features using EMBER
-        extractor = ember.PEFeatureExtractor(2)
-        features = np.array(extractor.feature_vector(file_bytes), dtype=np.float32)
-        
+        features = extract_features(file_bytes)
+
         # Reshape for sklearn-like pipeline (1 sample, N features)
         features = features.reshape(1, -1)
-        
-        # Apply Scaling
-        features_scaled = scaler.transform(features)
-        
-        # Apply PCA
-        features_pca = pca.transform(features_scaled)
-        
-        # Predict
-        # model.predict returns class labels, predict_proba returns probabilities
-        if hasattr(model, "predict_proba"):
-            probs = model.predict_proba(features_pca)
-            malicious_prob = float(probs[0][1]) # Probability of class 1 (Malicious)
-        else:
-            # Fallback if predict_proba is not available
-            prediction = model.predict(features_pca)
-            malicious_prob = float(prediction[0])
-        
-        # Threshold tuned for better recall (default 0.5 was too conservative)
-        THRESHOLD = 0.35
+
+        malicious_prob = float(predict_features(features)[0])
         label = "malicious" if malicious_prob > THRESHOLD else "benign"
+        cache_put(key, (label, malicious_prob))
         return label, malicious_prob
-        
+
     except Exception as e:
         print(f"Error during prediction: {e}")
         import traceback
         traceback.print_exc()
         return "Processing Error", 0.0
 
+def predict_feature_batch(features: list):
+    """
+    Score a batch of extracted feature vectors with a single pipeline call.
+    Entries that are exceptions (failed extraction) come back as "Processing Error".
+
+    Return:
+      list of (label: str, confidence: float), in input order
+    """
+    results = [("Processing Error", 0.0)] * len(features)
+    ok = []
+    for i, f in enumerate(features):
+        if isinstance(f, Exception):
+            print(f"Error during feature extraction: {f}")
+        else:
+            ok.append(i)
+    if not ok:
+        return results
+
+    try:
+        probs = predict_features(np.vstack([features[i] for i in ok]))
+    except Exception as e:
+        print(f"Error during batch prediction: {e}")
+        import traceback
+        traceback.print_exc()
+        return results
+
+    for i, prob in zip(ok, probs):
+        prob = float(prob)
+        results[i] = ("malicious" if prob > THRESHOLD else "benign", prob)
+    return results
+
+def build_warmup_pe() -> bytes:
+    """
+    A minimal valid PE32 image (headers plus a one-byte `ret` in .text) that passes
+    is_pe() and parses with LIEF, so warm-up exercises the real extraction path.
+    """
+    dos_header = b"MZ" + b"\0" * 58 + struct.pack("<I", 0x40)  # e_lfanew -> 0x40
+    file_header = struct.pack("<4sHHIIIHH", b"PE\0\0", 0x14C, 1, 0, 0, 0, 0xE0, 0x0102)
+    optional_header = struct.pack(
+        "<HBBIIIIIIIIIHHHHHHIIIIHHIIIIII",
+        0x10B, 14, 0, 0x200, 0, 0, 0x1000, 0x1000, 0x2000, 0x400000, 0x1000, 0x200,
+        6, 0, 0, 0, 6, 0, 0, 0x2000, 0x200, 0, 3, 0, 0x100000, 0x1000, 0x100000, 0x1000, 0, 16,
+    ) + b"\0" * (16 * 8)  # 16 empty data directories
+    section = struct.pack("<8sIIIIIIHHI", b".text", 1, 0x1000, 0x200, 0x200, 0, 0, 0, 0, 0x60000020)
+    headers = dos_header + file_header + optional_header + section
+    return headers.ljust(0x200, b"\0") + b"\xc3".ljust(0x200, b"\0")
+
+def warm_up():
+    """
+    Run one synthetic prediction so LIEF, numpy and XGBoost pay their first-call
+    costs at startup instead of on the first real request.
+    """
+    if model is None:
+        return
+    start = time.perf_counter()
+    label, _ = predict_file(build_warmup_pe())
+    print(f"Warm-up prediction finished in {time.perf_counter() - start:.2f}s ({label})")
+
 # ====== API ENDPOINT ======
+# Uploads larger than this are rejected before they are read into memory.
+# Generous enough for large installers.
+MAX_UPLOAD_SIZE = 256 * 1024 * 1024
+# Total bytes /predict_batch will hold in memory for one request
+MAX_BATCH_UPLOAD_SIZE = 512 * 1024 * 1024
+
+async def read_upload_within(file: UploadFile, limit: int):
+    """
+    Read an upload into memory, or return None if it is larger than `limit` bytes.
+    Starlette has already spooled the body and set file.size, so oversized files are
+    rejected without reading them; the bounded read covers servers that don't set it.
+    """
+    if file.size is not None and file.size > limit:
+        return None
+    file_bytes = await file.read(limit + 1)
+    return file_bytes if len(file_bytes) <= limit else None
+
+async def read_upload(file: UploadFile) -> bytes:
+    """Read a single upload, failing with 413 if it exceeds MAX_UPLOAD_SIZE."""
+    file_bytes = await read_upload_within(file, MAX_UPLOAD_SIZE)
+    if file_bytes is None:
+        raise HTTPException(status_code=413, detail="File too large")
+    return file_bytes
+
+async def read_batch_uploads(files: list[UploadFile]) -> list:
+    """
+    Read a batch of uploads under the per-file cap and a shared MAX_BATCH_UPLOAD_SIZE budget.
+
+    Return:
+      file bytes per upload, in order; None for files that didn't fit
+    """
+    contents = []
+    budget = MAX_BATCH_UPLOAD_SIZE
+    for file in files:
+        file_bytes = await read_upload_within(file, min(MAX_UPLOAD_SIZE, budget))
+        if file_bytes is not None:
+            budget -= len(file_bytes)
+        contents.append(file_bytes)
+    return contents
+
 @app.post("/predict", response_model=PredictionResponse)
 async def predict(file: UploadFile = File(...)):
     
     try:
-        file_bytes = await file.read()
+        file_bytes = await read_upload(file)
         if not file_bytes:
             raise HTTPException(status_code=400, detail="Empty file")
 
-        label, confidence = predict_file(file_bytes)
+        loop = asyncio.get_running_loop()
+        label, confidence = await loop.run_in_executor(EXECUTOR, predict_file, file_bytes)
 
         return PredictionResponse(
             label=label,
             confidence=confidence
         )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Internal error: {e}")
+
+@app.post("/predict_batch", response_model=list[PredictionResponse])
+async def predict_batch(files: list[UploadFile] = File(...)):
+    """Score several files at once; results are returned in upload order."""
+    try:
+        # Oversized files get their own "File too large" entry instead of failing the batch
+        contents = await read_batch_uploads(files)
+
+        if model is None:
+            return [PredictionResponse(label="Model not loaded", confidence=0.0) for _ in files]
+
+        # Empty and non-PE uploads are answered without hashing; PE files are looked up
+        # in the cache, and only cache misses go through the model
+        results = [None] * len(contents)
+        candidates = []
+        for i, b in enumerate(contents):
+            if b is None:
+                results[i] = ("File too large", 0.0)
+            elif not b:
+                results[i] = ("Empty file", 0.0)
+            elif not is_pe(b):
+                results[i] = ("benign", 0.0)
+            else:
+                candidates.append(i)
+        loop = asyncio.get_running_loop()
+        digests = await asyncio.gather(*(loop.run_in_executor(EXECUTOR, file_digest, contents[i]) for i in candidates))
+        keys = dict(zip(candidates, digests))
+        for i, key in keys.items():
+            results[i] = cache_get(key)
+        pending = [i for i in candidates if results[i] is None]
+
+        if pending:
+            # Extract features concurrently, then run the pipeline once on the stacked matrix
+            features = await asyncio.gather(
+                *(loop.run_in_executor(EXECUTOR, extract_features, contents[i]) for i in pending),
+                return_exceptions=True
+            )
+            scored = await loop.run_in_executor(EXECUTOR, predict_feature_batch, features)
+            for i, result in zip(pending, scored):
+                cache_put(keys[i], result)
+                results[i] = result
+
+        return [PredictionResponse(label=label, confidence=confidence) for label, confidence in results]
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Internal error: {e}")
 
 if __name__ == "__main__":
-    print("Starting server...")
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # Each worker process loads its own model copy
+    print(f"Starting server with {WORKERS} worker(s)...")
+    if os.environ.get("HTTP2") == "1":
+        # hypercorn speaks HTTP/2 (h2c on plain http), letting clients multiplex many
+        # requests over one connection; uvicorn only supports HTTP/1.1
+        from hypercorn.config import Config
+        from hypercorn.run import run
+        config = Config()
+        config.application_path = "main:app"
+        config.bind = ["0.0.0.0:8000"]
+        config.workers = WORKERS
+        run(config)
+    else:
+        # Workers re-import the app by name; uvicorn[standard] supplies uvloop + httptools
+        uvicorn.run("main:app", host="0.0.0.0", port=8000, workers=WORKERS)
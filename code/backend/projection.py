@@ -0,0 +1,100 @@
+# backend/projection.py
+"""
+StandardScaler + PCA folded into a single affine map, so inference is one matrix product:
+  pca.transform(scaler.transform(x)) == x @ weight.T + bias
+"""
+import hashlib
+import json
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+from sklearn.preprocessing import StandardScaler
+from sklearn.decomposition import PCA
+
+WEIGHT_FILE = "projection_weight.npy"
+BIAS_FILE = "projection_bias.npy"
+# SHA-256 of the scaler/PCA pickles the arrays were exported from
+SOURCES_FILE = "projection_sources.json"
+
+
+def sha256_file(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+@dataclass(frozen=True)
+class AffineProjection:
+    """Drop-in replacement for the scaler -> PCA pair with the same .transform API."""
+    weight: np.ndarray
+    bias: np.ndarray
+
+    def transform(self, features: np.ndarray) -> np.ndarray:
+        return features @ self.weight.T + self.bias
+
+    def save(self, directory: Path, sources):
+        """Save the arrays along with the digests of the `sources` pickles they came from."""
+        np.save(directory / WEIGHT_FILE, self.weight)
+        np.save(directory / BIAS_FILE, self.bias)
+        digests = {path.name: sha256_file(path) for path in sources}
+        (directory / SOURCES_FILE).write_text(json.dumps(digests, indent=2) + "\n")
+
+    @classmethod
+    def exists(cls, directory: Path) -> bool:
+        return (directory / WEIGHT_FILE).exists() and (directory / BIAS_FILE).exists()
+
+    @classmethod
+    def is_stale(cls, directory: Path, sources) -> bool:
+        """
+        True unless the arrays were exported from exactly the current `sources` pickles.
+        Compares content digests, since file mtimes don't survive a git checkout.
+        """
+        try:
+            recorded = json.loads((directory / SOURCES_FILE).read_text())
+        except (OSError, ValueError):
+            return True
+        return any(path.exists() and recorded.get(path.name) != sha256_file(path) for path in sources)
+
+    @classmethod
+    def load(cls, directory: Path):
+        """
+        Memory-map the saved arrays read-only. Nothing is unpickled, and worker
+        processes share the same page-cache copy of the weights.
+        """
+        weight = np.load(directory / WEIGHT_FILE, mmap_mode="r").view(np.ndarray)
+        bias = np.load(directory / BIAS_FILE, mmap_mode="r").view(np.ndarray)
+        return cls(weight, bias)
+
+
+def fuse_scaler_pca(scaler, pca):
+    """
+    Fold a fitted StandardScaler + PCA into one AffineProjection.
+
+    Return:
+      AffineProjection with float32 weights, or None if the pair can't be fused exactly
+    """
+    if not (isinstance(scaler, StandardScaler) and isinstance(pca, PCA)):
+        return None
+
+    n_features = pca.components_.shape[1]
+    mean = scaler.mean_ if scaler.with_mean else np.zeros(n_features)
+    scale = scaler.scale_ if scaler.with_std else np.ones(n_features)
+    components = pca.components_.astype(np.float64)
+    if pca.whiten:
+        components = components / np.sqrt(pca.explained_variance_)[:, np.newaxis]
+
+    W = components / scale
+    b = -W @ mean - components @ pca.mean_
+    projection = AffineProjection(W.astype(np.float32), b.astype(np.float32))
+
+    # Check the fused map against sklearn on samples drawn around the training distribution
+    rng = np.random.default_rng(0)
+    probe = (mean + rng.normal(size=(8, n_features)) * scale).astype(np.float32)
+    expected = pca.transform(scaler.transform(probe))
+    if not np.allclose(projection.transform(probe), expected, rtol=1e-4, atol=1e-4):
+        print("Warning: fused scaler+PCA disagrees with sklearn; using separate transforms")
+        return None
+    return projection
@@ -5,10 +5,12 @@ import os
 sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
 
 try:
-    from main import load_model, predict_file
-    print("Successfully imported load_model and predict_file from main.py")
-    model, scaler, pca = load_model()
-    if model:
+    import main
+    from main import init_model, predict_file
+    print("Successfully imported init_model and predict_file from main.py")
+    # The server loads the model in its lifespan handler; load it explicitly here
+    init_model()
+    if main.model:
         print("Model loaded successfully!")
     else:
         print("Model loading failed or returned None.")
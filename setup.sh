@@ -46,7 +46,7 @@ echo "[2/3] Installing dependencies (this may take 2-3 minutes)..."
 
 # Install all other dependencies
 ./venv/bin/pip install -q \
-    fastapi uvicorn python-multipart \
+    "fastapi>=0.130" "uvicorn[standard]" hypercorn python-multipart \
     xgboost scikit-learn joblib numpy \
     signify==0.7.1 \
     git+https://github.com/FutureComputing4AI/EMBER2024.git
@@ -3,58 +3,116 @@
 Batch test malware/benign samples against the API and generate accuracy metrics.
 """
 
-import requests
+import asyncio
 import os
 from pathlib import Path
-from concurrent.futures import ThreadPoolExecutor, as_completed
 
-API_URL = "http://localhost:8000/predict"
+import aiofiles
+import httpx
+
+API_URL = "http://localhost:8000/predict_batch"
+BATCH_SIZE = 32
+# A couple of batches in flight per server worker keeps every worker busy without
+# queueing thousands of files on the server. Defaults match the server's worker count.
+SERVER_WORKERS = int(os.environ.get("WEB_CONCURRENCY", max(1, (os.cpu_count() or 2) // 2)))
+MAX_CONCURRENCY = 2 * SERVER_WORKERS
+REQUEST_TIMEOUT = 300
+UPLOAD_CHUNK_SIZE = 64 * 1024
+# Set HTTP2=1 when the server runs under hypercorn (HTTP2=1 python app.py) to speak
+# HTTP/2 over cleartext, so every batch is a stream multiplexed on one connection
+HTTP2_PRIOR_KNOWLEDGE = os.environ.get("HTTP2") == "1"
 BASE_DIR = Path(__file__).parent
 MALWARE_DIR = BASE_DIR / "malware_samples"
 BENIGN_DIR = BASE_DIR / "benign_samples"
 
 
-def test_file(filepath: Path, expected_label: str) -> dict:
-    """Test a single file against the API."""
-    try:
-        with open(filepath, "rb") as f:
-            response = requests.post(
-                API_URL,
-                files={"file": (filepath.name, f)},
-                timeout=60
-            )
-
-        if response.status_code == 200:
-            data = response.json()
-            return {
-                "file": filepath.name,
-                "expected": expected_label,
-                "predicted": data["label"],
-                "confidence": data["confidence"],
-                "correct": data["label"] == expected_label,
-                "error": None
-            }
-        else:
-            return {
-                "file": filepath.name,
-                "expected": expected_label,
-                "predicted": None,
-                "confidence": 0,
-                "correct": False,
-                "error": f"HTTP {response.status_code}"
-            }
-    except Exception as e:
+async def read_chunks(filepath: Path):
+    """Yield the file in fixed-size chunks so uploads never buffer a whole sample."""
+    async with aiofiles.open(filepath, "rb") as f:
+        while chunk := await f.read(UPLOAD_CHUNK_SIZE):
+            yield chunk
+
+
+def multipart_upload(samples: list):
+    """
+    Build a streaming multipart/form-data body for a batch of (filepath, expected_label).
+    Files are opened one at a time while the body is sent, and read through aiofiles,
+    so a request holds a single file handle and disk reads never block the event loop.
+
+    Return:
+      (headers, async iterator over the body bytes)
+    """
+    boundary = os.urandom(16).hex()
+    parts = []
+    for filepath, _ in samples:
+        filename = filepath.name.replace('"', "%22")
+        head = (f'--{boundary}\r\n'
+                f'Content-Disposition: form-data; name="files"; filename="{filename}"\r\n'
+                f'Content-Type: application/octet-stream\r\n\r\n')
+        parts.append((head.encode(), filepath))
+    closing = f"--{boundary}--\r\n".encode()
+    length = sum(len(head) + filepath.stat().st_size + 2 for head, filepath in parts) + len(closing)
+
+    async def body():
+        for head, filepath in parts:
+            yield head
+            async for chunk in read_chunks(filepath):
+                yield chunk
+            yield b"\r\n"
+        yield closing
+
+    headers = {
+        "Content-Type": f"multipart/form-data; boundary={boundary}",
+        "Content-Length": str(length),
+    }
+    return headers, body()
+
+
+def make_result(filepath: Path, expected_label: str, data: dict = None, error: str = None) -> dict:
+    """Build the per-file result record used by the metrics summary."""
+    # /predict_batch reports per-file failures ("Empty file", "Processing Error", ...)
+    # as labels; count them as errors like the per-file endpoint's HTTP errors
+    if data is not None and data["label"] not in ("malicious", "benign"):
+        data, error = None, data["label"]
+    if data is None:
         return {
             "file": filepath.name,
             "expected": expected_label,
             "predicted": None,
             "confidence": 0,
             "correct": False,
-            "error": str(e)
+            "error": error
         }
+    return {
+        "file": filepath.name,
+        "expected": expected_label,
+        "predicted": data["label"],
+        "confidence": data["confidence"],
+        "correct": data["label"] == expected_label,
+        "error": None
+    }
+
+
+async def test_batch(client: httpx.AsyncClient, sem: asyncio.Semaphore,
+                     samples: list) -> list:
+    """Test a batch of (filepath, expected_label) samples with one API call."""
+    try:
+        async with sem:
+            headers, body = multipart_upload(samples)
+            response = await client.post(API_URL, content=body, headers=headers)
+
+        if response.status_code == 200:
+            return [make_result(filepath, expected, item)
+                    for (filepath, expected), item in zip(samples, response.json())]
+        else:
+            return [make_result(filepath, expected, error=f"HTTP {response.status_code}")
+                    for filepath, expected in samples]
+    except Exception as e:
+        return [make_result(filepath, expected, error=str(e) or type(e).__name__)
+                for filepath, expected in samples]
 
 
-def main():
+async def main():
     results = []
 
     # Get all sample files
@@ -63,30 +121,36 @@ def main():
 
     print(f"Testing {len(malware_files)} malware samples and {len(benign_files)} benign samples...\n")
 
-    # Test in parallel for speed
-    with ThreadPoolExecutor(max_workers=4) as executor:
-        futures = []
-
-        for f in malware_files:
-            if f.is_file():
-                futures.append(executor.submit(test_file, f, "malicious"))
-
-        for f in benign_files:
-            if f.is_file():
-                futures.append(executor.submit(test_file, f, "benign"))
-
-        for i, future in enumerate(as_completed(futures)):
-            result = future.result()
-            results.append(result)
-
-            status = "CORRECT" if result["correct"] else "WRONG"
-            if result["error"]:
-                status = f"ERROR: {result['error']}"
-
-            print(f"[{i+1}/{len(futures)}] {result['file'][:40]:40} | "
-                  f"Expected: {result['expected']:9} | "
-                  f"Got: {str(result['predicted']):9} | "
-                  f"Conf: {result['confidence']*100:5.1f}% | {status}")
+    # Test concurrently on a single event loop; the semaphore bounds in-flight uploads
+    sem = asyncio.Semaphore(MAX_CONCURRENCY)
+    limits = httpx.Limits(max_connections=MAX_CONCURRENCY, max_keepalive_connections=MAX_CONCURRENCY)
+    timeout = httpx.Timeout(REQUEST_TIMEOUT)
+
+    samples = [(f, "malicious") for f in malware_files if f.is_file()]
+    samples += [(f, "benign") for f in benign_files if f.is_file()]
+
+    # One pooled client for the whole run. HTTP/2 (which needs the h2 package) is only
+    # enabled when HTTP2_PRIOR_KNOWLEDGE is set; the default is plain HTTP/1.1.
+    async with httpx.AsyncClient(http1=not HTTP2_PRIOR_KNOWLEDGE, http2=HTTP2_PRIOR_KNOWLEDGE,
+                                 limits=limits, timeout=timeout) as client:
+        # Send samples in batches so the server scores each group with one pipeline call
+        tasks = [
+            test_batch(client, sem, samples[i:i + BATCH_SIZE])
+            for i in range(0, len(samples), BATCH_SIZE)
+        ]
+
+        for future in asyncio.as_completed(tasks):
+            for result in await future:
+                results.append(result)
+
+                status = "CORRECT" if result["correct"] else "WRONG"
+                if result["error"]:
+                    status = f"ERROR: {result['error']}"
+
+                print(f"[{len(results)}/{len(samples)}] {result['file'][:40]:40} | "
+                      f"Expected: {result['expected']:9} | "
+                      f"Got: {str(result['predicted']):9} | "
+                      f"Conf: {result['confidence']*100:5.1f}% | {status}")
 
     # Calculate metrics
     print("\n" + "="*80)
@@ -144,4 +208,4 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())
@@ -5,24 +5,36 @@ For educational/research purposes only.
 """
 
 import requests
+from requests.adapters import HTTPAdapter
 import zipfile
-import io
+import tempfile
+import json
 import os
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 BASE_DIR = Path(__file__).parent
 MALWARE_DIR = BASE_DIR / "malware_samples"
 BENIGN_DIR = BASE_DIR / "benign_samples"
+# Kept outside BENIGN_DIR so batch_test.py doesn't treat it as a sample
+MANIFEST_PATH = BASE_DIR / "benign_manifest.json"
 
 MALWARE_DIR.mkdir(exist_ok=True)
 BENIGN_DIR.mkdir(exist_ok=True)
 
+# Shared session so every request to the same host reuses a keep-alive connection
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(pool_connections=10, pool_maxsize=10, max_retries=0))
+
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+SPOOL_MAX_SIZE = 16 * 1024 * 1024
+
 def download_malware_samples(count=10):
     """Download recent PE malware samples from MalwareBazaar."""
     print(f"Fetching {count} malware samples from MalwareBazaar...")
 
     # Query for recent exe samples
-    response = requests.post(
+    response = SESSION.post(
         "https://mb-api.abuse.ch/api/v1/",
         data={"query": "get_file_type", "file_type": "exe", "limit": count}
     )
@@ -55,37 +67,113 @@ def download_malware_samples(count=10):
         print(f"  Downloading {filename}...")
         try:
             # Download the sample (comes as password-protected zip, password: "infected")
-            dl_response = requests.post(
+            # Stream into a spooled temp file: small zips stay in memory, large ones go to disk
+            with SESSION.post(
                 "https://mb-api.abuse.ch/api/v1/",
                 data={"query": "get_file", "sha256_hash": sha256},
-                timeout=30
-            )
-
-            if dl_response.status_code == 200 and len(dl_response.content) > 100:
-                # Extract from zip with password "infected"
-                try:
-                    with zipfile.ZipFile(io.BytesIO(dl_response.content)) as zf:
-                        zf.extractall(path=MALWARE_DIR, pwd=b"infected")
-                        # Rename extracted file
-                        for name in zf.namelist():
-                            extracted = MALWARE_DIR / name
-                            if extracted.exists():
-                                extracted.rename(filepath)
-                                downloaded += 1
-                                print(f"    Saved {filename}")
-                                break
-                except zipfile.BadZipFile:
-                    print(f"    Bad zip for {sha256[:16]}")
-                except Exception as e:
-                    print(f"    Extract error: {e}")
-            else:
-                print(f"    Download failed for {sha256[:16]}")
+                timeout=30,
+                stream=True
+            ) as dl_response, tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE) as archive:
+                if dl_response.status_code == 200:
+                    for chunk in dl_response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                        archive.write(chunk)
+
+                if dl_response.status_code == 200 and archive.tell() > 100:
+                    # Extract from zip with password "infected"
+                    archive.seek(0)
+                    try:
+                        with zipfile.ZipFile(archive) as zf:
+                            zf.extractall(path=MALWARE_DIR, pwd=b"infected")
+                            # Rename extracted file
+                            for name in zf.namelist():
+                                extracted = MALWARE_DIR / name
+                                if extracted.exists():
+                                    extracted.rename(filepath)
+                                    downloaded += 1
+                                    print(f"    Saved {filename}")
+                                    break
+                    except zipfile.BadZipFile:
+                        print(f"    Bad zip for {sha256[:16]}")
+                    except Exception as e:
+                        print(f"    Extract error: {e}")
+                else:
+                    print(f"    Download failed for {sha256[:16]}")
         except Exception as e:
             print(f"    Error: {e}")
 
     print(f"Downloaded {downloaded} malware samples")
 
 
+def load_manifest():
+    """Load the filename -> {etag, last_modified} record of previously downloaded files."""
+    try:
+        return json.loads(MANIFEST_PATH.read_text())
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def remote_version(headers):
+    """Extract the ETag/Last-Modified validators from response headers, or None if absent."""
+    etag = headers.get("ETag")
+    last_modified = headers.get("Last-Modified")
+    if not (etag or last_modified):
+        return None
+    return {"etag": etag, "last_modified": last_modified}
+
+
+def download_benign_file(url, filename, manifest):
+    """
+    Stream one benign executable to disk in chunks. Returns True if it was saved.
+    A HEAD request is compared against the manifest first, so unchanged files aren't re-fetched.
+    """
+    filepath = BENIGN_DIR / filename
+
+    if filepath.exists():
+        try:
+            head = SESSION.head(url, timeout=30, allow_redirects=True)
+            version = remote_version(head.headers) if head.status_code == 200 else None
+        except requests.RequestException:
+            version = None
+
+        known = manifest.get(filename)
+        if version is None or known is None or known == version:
+            # Unchanged upstream (or nothing to compare against): keep the local copy
+            if version is not None:
+                manifest[filename] = version
+            print(f"  Skipping {filename} (up to date)")
+            return False
+        print(f"  {filename} changed upstream")
+
+    print(f"  Downloading {filename}...")
+    partial = filepath.with_name(filename + ".part")
+    try:
+        with SESSION.get(url, timeout=30, stream=True) as response:
+            if response.status_code != 200:
+                print(f"    Failed {filename}: status {response.status_code}")
+                return False
+
+            size = 0
+            with open(partial, "wb") as f:
+                for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    f.write(chunk)
+                    size += len(chunk)
+            version = remote_version(response.headers)
+
+        if size > 1000:
+            partial.replace(filepath)
+            if version is not None:
+                manifest[filename] = version
+            print(f"    Saved {filename} ({size} bytes)")
+            return True
+        print(f"    Failed {filename}: only {size} bytes")
+        return False
+    except Exception as e:
+        print(f"    Error downloading {filename}: {e}")
+        return False
+    finally:
+        partial.unlink(missing_ok=True)
+
+
 def download_benign_samples():
     """Download legitimate Windows executables from trusted sources."""
     print("Downloading benign samples...")
@@ -104,25 +192,16 @@ def download_benign_samples():
         ("https://live.sysinternals.com/du.exe", "du.exe"),
     ]
 
-    downloaded = 0
-    for url, filename in benign_urls:
-        filepath = BENIGN_DIR / filename
-
-        if filepath.exists():
-            print(f"  Skipping {filename} (exists)")
-            continue
-
-        print(f"  Downloading {filename}...")
-        try:
-            response = requests.get(url, timeout=30)
-            if response.status_code == 200 and len(response.content) > 1000:
-                filepath.write_bytes(response.content)
-                downloaded += 1
-                print(f"    Saved {filename} ({len(response.content)} bytes)")
-            else:
-                print(f"    Failed: status {response.status_code}")
-        except Exception as e:
-            print(f"    Error: {e}")
+    # Downloads are independent, so fetch them concurrently over the shared session.
+    # Each worker only writes its own filename key, so the manifest dict needs no lock.
+    manifest = load_manifest()
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        futures = [
+            executor.submit(download_benign_file, url, filename, manifest)
+            for url, filename in benign_urls
+        ]
+        downloaded = sum(future.result() for future in futures)
+    MANIFEST_PATH.write_text(json.dumps(manifest, indent=2, sort_keys=True))
 
     print(f"Downloaded {downloaded} benign samples")
 
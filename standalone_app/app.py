@@ -6,6 +6,14 @@ EMBER 2024 XGBoost Model with built-in web UI
 
 import os
 import sys
+import asyncio
+import hashlib
+import struct
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 from pathlib import Path
 
 # Determine base path for bundled app or dev mode
@@ -37,7 +45,18 @@ except ImportError:
     THREMBER_AVAILABLE = False
     print("✗ thrember not available")
 
-app = FastAPI(title="Malware Scanner - EMBER 2024")
+# Build the extractor once; it holds no per-file state, so worker threads can share it
+EXTRACTOR = thrember.PEFeatureExtractor() if THREMBER_AVAILABLE else None
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Load the model inside each worker process at startup rather than at import time
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, init_model)
+    await loop.run_in_executor(EXECUTOR, warm_up)
+    yield
+
+app = FastAPI(title="Malware Scanner - EMBER 2024", lifespan=lifespan)
 
 # CORS for development
 app.add_middleware(
@@ -48,6 +67,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Endpoints declare this as response_model, which lets FastAPI >= 0.130 serialize replies
+# straight to JSON bytes in Pydantic's Rust core. Keep the default response class:
+# a custom one such as ORJSONResponse would bypass that path.
 class PredictionResponse(BaseModel):
     label: str
     confidence: float
@@ -97,6 +119,13 @@ def load_model():
     try:
         model = xgb.XGBClassifier()
         model.load_model(str(model_path))
+        # Keep XGBoost to this worker's share of the cores instead of all of them
+        model.set_params(n_jobs=THREADS_PER_WORKER)
+        # Optional GPU inference, e.g. MODEL_DEVICE=cuda (XGBoost >= 2.0)
+        device = os.environ.get("MODEL_DEVICE")
+        if device:
+            model.set_params(device=device)
+            print(f"✓ XGBoost inference device: {device}")
         scaler = joblib.load(scaler_path)
         print(f"✓ Model loaded: {model_path}")
         print(f"✓ Scaler loaded: {scaler_path}")
@@ -105,18 +134,82 @@ def load_model():
         print(f"✗ Error loading model: {e}")
         return None, None
 
-model, scaler = load_model()
+# Populated by init_model() from the app's lifespan handler
+model = scaler = None
+
+def init_model():
+    """Load the model and scaler into the module globals used by predict_file."""
+    global model, scaler
+    model, scaler = load_model()
+
+THRESHOLD = 0.5
+
+# Server worker processes: one per two cores unless WEB_CONCURRENCY says otherwise.
+# PyInstaller bundles always run a single process.
+if getattr(sys, 'frozen', False):
+    WORKERS = 1
+else:
+    WORKERS = int(os.environ.get("WEB_CONCURRENCY", max(1, (os.cpu_count() or 2) // 2)))
+# Each worker process gets its share of the cores for its threads and for XGBoost
+THREADS_PER_WORKER = max(1, (os.cpu_count() or 1) // WORKERS)
+
+# Worker threads for CPU-bound feature extraction and inference, kept off the event loop.
+# numpy and XGBoost release the GIL in native code, so requests overlap instead of queueing.
+EXECUTOR = ThreadPoolExecutor(max_workers=THREADS_PER_WORKER)
+
+# ====== PREDICTION CACHE ======
+# LRU cache of recent predictions keyed by the SHA-256 digest of the file contents,
+# so re-submitted samples skip extraction and inference entirely
+PREDICTION_CACHE_SIZE = 10_000
+_prediction_cache = OrderedDict()
+_prediction_cache_lock = threading.Lock()
+
+def file_digest(file_bytes: bytes) -> bytes:
+    return hashlib.sha256(file_bytes).digest()
+
+def cache_get(key: bytes):
+    """Return the cached (label, confidence) for `key`, or None."""
+    with _prediction_cache_lock:
+        result = _prediction_cache.get(key)
+        if result is not None:
+            _prediction_cache.move_to_end(key)
+        return result
+
+def cache_put(key: bytes, result):
+    """Remember a successful prediction, evicting the least recently used entry when full."""
+    if result[0] not in ("malicious", "benign"):
+        return
+    with _prediction_cache_lock:
+        _prediction_cache[key] = result
+        _prediction_cache.move_to_end(key)
+        if len(_prediction_cache) > PREDICTION_CACHE_SIZE:
+            _prediction_cache.popitem(last=False)
 
 # ====== FEATURE EXTRACTION ======
+def is_pe(file_bytes: bytes) -> bool:
+    """Cheap MZ + PE signature check so non-PE uploads never reach the LIEF parser."""
+    if len(file_bytes) < 0x40 or file_bytes[:2] != b"MZ":
+        return False
+    pe_offset = int.from_bytes(file_bytes[0x3C:0x40], "little")
+    return file_bytes[pe_offset:pe_offset + 4] == b"PE\x00\x00"
+
 def extract_features(file_bytes: bytes) -> np.ndarray:
     """Extract EMBER v3 features (2,568 dimensions)."""
     if not THREMBER_AVAILABLE:
         raise RuntimeError("thrember not installed")
-    extractor = thrember.PEFeatureExtractor()
-    features = np.array(extractor.feature_vector(file_bytes), dtype=np.float32)
+    features = np.array(EXTRACTOR.feature_vector(file_bytes), dtype=np.float32)
     return features
 
 # ====== PREDICTION ======
+def predict_features(features: np.ndarray) -> np.ndarray:
+    """Scale an (N, 2568) feature matrix and return the malicious probability per row."""
+    features = np.nan_to_num(features, nan=0.0, posinf=1e10, neginf=-1e10)
+    features_scaled = scaler.transform(features)
+    
+    if hasattr(model, "predict_proba"):
+        return model.predict_proba(features_scaled)[:, 1]
+    return np.asarray(model.predict(features_scaled), dtype=np.float64)
+
 def predict_file(file_bytes: bytes):
     """Extract features and predict."""
     if model is None:
@@ -125,20 +218,22 @@ def predict_file(file_bytes: bytes):
     if not THREMBER_AVAILABLE:
         return "Feature extractor not available", 0.0
     
+    # Anything without a PE header can't be a Windows executable
+    if not is_pe(file_bytes):
+        return "benign", 0.0
+    
+    key = file_digest(file_bytes)
+    cached = cache_get(key)
+    if cached is not None:
+        return cached
+    
     try:
         features = extract_features(file_bytes)
         features = features.reshape(1, -1)
-        features = np.nan_to_num(features, nan=0.0, posinf=1e10, neginf=-1e10)
-        features_scaled = scaler.transform(features)
+        malicious_prob = float(predict_features(features)[0])
         
-        if hasattr(model, "predict_proba"):
-            probs = model.predict_proba(features_scaled)
-            malicious_prob = float(probs[0][1])
-        else:
-            prediction = model.predict(features_scaled)
-            malicious_prob = float(prediction[0])
-        
-        label = "malicious" if malicious_prob > 0.5 else "benign"
+        label = "malicious" if malicious_prob > THRESHOLD else "benign"
+        cache_put(key, (label, malicious_prob))
         return label, malicious_prob
         
     except Exception as e:
@@ -147,6 +242,58 @@ def predict_file(file_bytes: bytes):
         traceback.print_exc()
         return "Processing Error", 0.0
 
+def predict_feature_batch(features: list):
+    """Score extracted feature vectors in one pipeline call; exceptions become "Processing Error"."""
+    results = [("Processing Error", 0.0)] * len(features)
+    ok = []
+    for i, f in enumerate(features):
+        if isinstance(f, Exception):
+            print(f"Error during feature extraction: {f}")
+        else:
+            ok.append(i)
+    if not ok:
+        return results
+    
+    try:
+        probs = predict_features(np.vstack([features[i] for i in ok]))
+    except Exception as e:
+        print(f"Error during batch prediction: {e}")
+        import traceback
+        traceback.print_exc()
+        return results
+    
+    for i, prob in zip(ok, probs):
+        prob = float(prob)
+        results[i] = ("malicious" if prob > THRESHOLD else "benign", prob)
+    return results
+
+def build_warmup_pe() -> bytes:
+    """
+    A minimal valid PE32 image (headers plus a one-byte `ret` in .text) that passes
+    is_pe() and parses with LIEF, so warm-up exercises the real extraction path.
+    """
+    dos_header = b"MZ" + b"\0" * 58 + struct.pack("<I", 0x40)  # e_lfanew -> 0x40
+    file_header = struct.pack("<4sHHIIIHH", b"PE\0\0", 0x14C, 1, 0, 0, 0, 0xE0, 0x0102)
+    optional_header = struct.pack(
+        "<HBBIIIIIIIIIHHHHHHIIIIHHIIIIII",
+        0x10B, 14, 0, 0x200, 0, 0, 0x1000, 0x1000, 0x2000, 0x400000, 0x1000, 0x200,
+        6, 0, 0, 0, 6, 0, 0, 0x2000, 0x200, 0, 3, 0, 0x100000, 0x1000, 0x100000, 0x1000, 0, 16,
+    ) + b"\0" * (16 * 8)  # 16 empty data directories
+    section = struct.pack("<8sIIIIIIHHI", b".text", 1, 0x1000, 0x200, 0x200, 0, 0, 0, 0, 0x60000020)
+    headers = dos_header + file_header + optional_header + section
+    return headers.ljust(0x200, b"\0") + b"\xc3".ljust(0x200, b"\0")
+
+def warm_up():
+    """
+    Run one synthetic prediction so LIEF, numpy and XGBoost pay their first-call
+    costs at startup instead of on the first real request.
+    """
+    if model is None:
+        return
+    start = time.perf_counter()
+    label, _ = predict_file(build_warmup_pe())
+    print(f"Warm-up prediction finished in {time.perf_counter() - start:.2f}s ({label})")
+
 # ====== API ENDPOINTS ======
 @app.get("/api/health")
 def health_check():
@@ -156,20 +303,116 @@ def health_check():
         "thrember_available": THREMBER_AVAILABLE
     }
 
+# Uploads larger than this are rejected before they are read into memory.
+# Generous enough for large installers.
+MAX_UPLOAD_SIZE = 256 * 1024 * 1024
+# Total bytes /predict_batch will hold in memory for one request
+MAX_BATCH_UPLOAD_SIZE = 512 * 1024 * 1024
+
+async def read_upload_within(file: UploadFile, limit: int):
+    """
+    Read an upload into memory, or return None if it is larger than `limit` bytes.
+    Starlette has already spooled the body and set file.size, so oversized files are
+    rejected without reading them; the bounded read covers servers that don't set it.
+    """
+    if file.size is not None and file.size > limit:
+        return None
+    file_bytes = await file.read(limit + 1)
+    return file_bytes if len(file_bytes) <= limit else None
+
+async def read_upload(file: UploadFile) -> bytes:
+    """Read a single upload, failing with 413 if it exceeds MAX_UPLOAD_SIZE."""
+    file_bytes = await read_upload_within(file, MAX_UPLOAD_SIZE)
+    if file_bytes is None:
+        raise HTTPException(status_code=413, detail="File too large")
+    return file_bytes
+
+async def read_batch_uploads(files: list[UploadFile]) -> list:
+    """
+    Read a batch of uploads under the per-file cap and a shared MAX_BATCH_UPLOAD_SIZE budget.
+
+    Return:
+      file bytes per upload, in order; None for files that didn't fit
+    """
+    contents = []
+    budget = MAX_BATCH_UPLOAD_SIZE
+    for file in files:
+        file_bytes = await read_upload_within(file, min(MAX_UPLOAD_SIZE, budget))
+        if file_bytes is not None:
+            budget -= len(file_bytes)
+        contents.append(file_bytes)
+    return contents
+
 @app.post("/predict", response_model=PredictionResponse)
 async def predict(file: UploadFile = File(...)):
     try:
-        file_bytes = await file.read()
+        file_bytes = await read_upload(file)
         if not file_bytes:
             raise HTTPException(status_code=400, detail="Empty file")
         
-        label, confidence = predict_file(file_bytes)
+        loop = asyncio.get_running_loop()
+        label, confidence = await loop.run_in_executor(EXECUTOR, predict_file, file_bytes)
         
         return PredictionResponse(
             label=label,
             confidence=confidence,
             model_version="ember2024"
         )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Internal error: {e}")
+
+@app.post("/predict_batch", response_model=list[PredictionResponse])
+async def predict_batch(files: list[UploadFile] = File(...)):
+    """Score several files at once; results are returned in upload order."""
+    try:
+        # Oversized files get their own "File too large" entry instead of failing the batch
+        contents = await read_batch_uploads(files)
+        
+        if model is None:
+            error = "Model not loaded"
+        elif not THREMBER_AVAILABLE:
+            error = "Feature extractor not available"
+        else:
+            error = None
+        if error:
+            return [PredictionResponse(label=error, confidence=0.0) for _ in files]
+        
+        # Empty and non-PE uploads are answered without hashing; PE files are looked up
+        # in the cache, and only cache misses go through the model
+        results = [None] * len(contents)
+        candidates = []
+        for i, b in enumerate(contents):
+            if b is None:
+                results[i] = ("File too large", 0.0)
+            elif not b:
+                results[i] = ("Empty file", 0.0)
+            elif not is_pe(b):
+                results[i] = ("benign", 0.0)
+            else:
+                candidates.append(i)
+        loop = asyncio.get_running_loop()
+        digests = await asyncio.gather(*(loop.run_in_executor(EXECUTOR, file_digest, contents[i]) for i in candidates))
+        keys = dict(zip(candidates, digests))
+        for i, key in keys.items():
+            results[i] = cache_get(key)
+        pending = [i for i in candidates if results[i] is None]
+        
+        if pending:
+            # Extract features concurrently, then run the pipeline once on the stacked matrix
+            features = await asyncio.gather(
+                *(loop.run_in_executor(EXECUTOR, extract_features, contents[i]) for i in pending),
+                return_exceptions=True
+            )
+            scored = await loop.run_in_executor(EXECUTOR, predict_feature_batch, features)
+            for i, result in zip(pending, scored):
+                cache_put(keys[i], result)
+                results[i] = result
+        
+        return [PredictionResponse(label=label, confidence=confidence) for label, confidence in results]
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Internal error: {e}")
 
@@ -215,7 +458,24 @@ def main():
     print(f"\n  Open your browser to: http://localhost:8000\n")
     print("="*50 + "\n")
     
-    uvicorn.run(app, host="0.0.0.0", port=8000, log_level="info")
+    if getattr(sys, 'frozen', False):
+        # PyInstaller bundles can't re-import the app by name, so stay single-process
+        uvicorn.run(app, host="0.0.0.0", port=8000, log_level="info")
+        return
+    
+    if os.environ.get("HTTP2") == "1":
+        # hypercorn speaks HTTP/2 (h2c on plain http), letting clients multiplex many
+        # requests over one connection; uvicorn only supports HTTP/1.1
+        from hypercorn.config import Config
+        from hypercorn.run import run
+        config = Config()
+        config.application_path = "app:app"
+        config.bind = ["0.0.0.0:8000"]
+        config.workers = WORKERS
+        run(config)
+    else:
+        # uvicorn[standard] supplies uvloop + httptools
+        uvicorn.run("app:app", host="0.0.0.0", port=8000, log_level="info", workers=WORKERS)
 
 if __name__ == "__main__":
     main()